@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice, repeat
 import functools
 import multiprocessing as mp
+from multiprocessing import shared_memory
 import os
 import pickle
 import random
@@ -14,15 +16,20 @@ from pmf_cy import ProbabilisticMatrixFactorization
 from bayes_pmf import BayesianPMF
 
 
-rmse = lambda exp, real: np.sqrt(((real - exp)**2).sum() / real.size)
+def rmse(exp, real, out=None):
+    '''
+    Root mean squared error between exp and real. If out is passed, the
+    residuals are written into it instead of a new temporary.
+    '''
+    diff = np.subtract(real, exp, out=out)
+    return np.sqrt(np.vdot(diff, diff) / real.size)
 
 def fit(real, known, latent_d=1, ret_pmf=False, subtract_mean=False,
         sig_u=1e10, sig_v=1e10, sig=1,
         do_bayes=False, burnin=10, samps=200,
         stop_thresh=1e-10, min_learning_rate=1e-20):
-    ratings = np.zeros((known.sum(), 3))
-    for idx, (i, j) in enumerate(np.transpose(known.nonzero())):
-        ratings[idx] = [i, j, real[i, j]]
+    ii, jj = known.nonzero()
+    ratings = np.column_stack((ii.astype(float), jj.astype(float), real[ii, jj]))
 
     pmf = ProbabilisticMatrixFactorization(ratings, latent_d, subtract_mean)
     pmf.sigma_sq = sig
@@ -47,21 +54,59 @@ def fit(real, known, latent_d=1, ret_pmf=False, subtract_mean=False,
         return (bpmf, pred) if ret_pmf else pred
 
 
-def fit_worker(real, known, num_fits, job_q, result_q, **fit_kwargs):
-    real_rmse = functools.partial(rmse, real)
+def _share_array(arr):
+    '''
+    Copies arr into a new shared memory block, returning the block. The
+    caller is responsible for close()ing and unlink()ing it.
+    '''
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+    return shm
+
+def _attach_array(name, shape, dtype):
+    '''
+    Attaches to a shared memory block made by _share_array, returning the
+    block and an ndarray view onto it. Keep the block around for as long
+    as the view is in use.
+    '''
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype, buffer=shm.buf)
+
+
+# per-process state for fit_worker, set up once by _init_fit_worker
+_worker_state = {}
+
+def _init_fit_worker(names, shapes, dtypes, num_fits, fit_kwargs):
+    # names, shapes, dtypes describe the shared memory blocks for real and
+    # known; work on a view of real, and on a private copy of known that we
+    # can flip entries of in place
+    (real_shm, real), (known_shm, known) = map(
+            _attach_array, names, shapes, dtypes)
+    _worker_state.update(
+        shms=(real_shm, known_shm), # keeps the view of real valid
+        real=real,
+        known=np.array(known),
+        num_fits=num_fits,
+        fit_kwargs=fit_kwargs,
+        real_rmse=functools.partial(rmse, real),
+        rmse_buf=np.empty(real.shape),
+    )
     random.seed()
     np.random.seed()
 
-    for i, j in iter(job_q.get, None): # iterate until we see stop sentinel
-        new_known = known.copy()
-        new_known[i, j] = True
-
-        fits = [fit(real=real, known=new_known, **fit_kwargs)
-                for x in range(num_fits)]
-        rmses = sorted(map(real_rmse, fits))
-        result_q.put((i, j, fits, rmses), timeout=5)
+def fit_worker(ij):
+    i, j = ij
+    st = _worker_state
+    known = st['known']
 
-    result_q.put(None) # send sentinel saying we're done
+    known[i, j] = True
+    try:
+        fits = [fit(real=st['real'], known=known, **st['fit_kwargs'])
+                for x in range(st['num_fits'])]
+    finally:
+        known[i, j] = False
+    rmses = sorted(st['real_rmse'](f, out=st['rmse_buf']) for f in fits)
+    return i, j, fits, rmses
 
 def dummy_helper(args):
     real, known, fit_kwargs, iter_num = args
@@ -92,40 +137,34 @@ def get_fit_options(real, known, num_fits=3, pick=None, procs=None, **fit_kwargs
     child_rmses = {}
     rmses_arr = np.empty(real.shape); rmses_arr.fill(np.nan)
 
-    job_q = mp.Queue()
-    result_q = mp.Queue()
-
-    workers = [mp.Process(target=fit_worker,
-                          args=(real, known, num_fits, job_q, result_q),
-                          kwargs=fit_kwargs)
-               for _ in range(procs)]
-
-    for w in workers:
-        w.start()
-
-    # put in actual jobs
-    for i, j in zip(*np.logical_not(known).nonzero()):
-        job_q.put((i, j))
-    # sentinels to say you're done
-    for w in workers:
-        job_q.put(None)
-
-    num_done = 0
-    while True:
-        resp = result_q.get()
-        if resp is None:
-            num_done += 1
-            if num_done == procs:
-                break
-            continue
-
-        i, j, fits, rmses = resp
-        child_fits[i, j] = fits
-        child_rmses[i, j] = rmses
-        rmses_arr[i, j] = rmses[pick]
-
-    for w in workers:
-        w.join()
+    # workers attach to these rather than each getting their own copy,
+    # so only the (i, j) pairs get sent over with each job
+    real_shm = _share_array(real)
+    known_shm = _share_array(known)
+    shm_args = ((real_shm.name, known_shm.name),
+                (real.shape, known.shape),
+                (real.dtype, known.dtype))
+
+    jobs = list(zip(*np.logical_not(known).nonzero()))
+
+    # each job is num_fits full fits, so keep chunks small enough that
+    # the workers finish at about the same time (same heuristic as Pool.map)
+    chunksize, extra = divmod(len(jobs), procs * 4)
+    if extra or not chunksize:
+        chunksize += 1
+
+    try:
+        with ProcessPoolExecutor(procs, initializer=_init_fit_worker,
+                initargs=shm_args + (num_fits, fit_kwargs)) as ex:
+            for i, j, fits, rmses in ex.map(fit_worker, jobs,
+                                            chunksize=chunksize):
+                child_fits[i, j] = fits
+                child_rmses[i, j] = rmses
+                rmses_arr[i, j] = rmses[pick]
+    finally:
+        for shm in (real_shm, known_shm):
+            shm.close()
+            shm.unlink()
 
     return init_rmse, child_fits, child_rmses, rmses_arr
 
@@ -159,8 +198,10 @@ def add_to_datafile(path, force=False, num_fits=5, pick=None, procs=None,
     diffs = (init - rmses)[np.isfinite(rmses)]
     print("{:.3} to {:.3}".format(np.min(diffs), np.max(diffs)))
 
+    # protocol 5 writes numpy arrays' data straight from their buffers,
+    # rather than copying each into a bytes object first
     with open(path + '.tmp', 'wb') as f:
-        pickle.dump(data, f)
+        pickle.dump(data, f, protocol=5)
     os.rename(path, path + '.bak')
     os.rename(path + '.tmp', path)
 
@@ -3,26 +3,29 @@ cimport numpy as np
 
 from pmf_cy cimport ProbabilisticMatrixFactorization
 
-@cython.locals(n=cython.int, chol=np.ndarray, X=np.ndarray, Y=np.ndarray)
+@cython.locals(n=cython.int, chol=np.ndarray, A=np.ndarray,
+               X=np.ndarray, Y=np.ndarray)
 cpdef np.ndarray sample_wishart(np.ndarray sigma, int dof)
 
 
-@cython.locals(count=cython.int)
-cpdef object iter_mean(object iterable)
-
-
 cdef class BayesianPMF(ProbabilisticMatrixFactorization):
     cdef public float beta
     cdef public tuple _rating_values
     cdef public np.ndarray _rating_bounds
     cdef public bint discrete_expectations
     cdef public int num_integration_pts
-    cdef public tuple u_hyperparams, v_hyperparams
+    cdef public tuple _u_hyperparams, _v_hyperparams
+    cdef public np.ndarray _u_wi_inv, _v_wi_inv
 
     #cpdef BayesianPMF __copy__(self)
     #cpdef BayesianPMF __deepcopy__(self, object memodict)
     cpdef dict __getstate__(self)
 
+    cpdef dict snapshot(self)
+
+    @cython.locals(state=dict)
+    cpdef restore(self, dict snap)
+
     @cython.locals(
         wi = np.ndarray,
         b0 = int,
@@ -32,21 +35,33 @@ cdef class BayesianPMF(ProbabilisticMatrixFactorization):
         x_bar = np.ndarray,
         S_bar = np.ndarray,
         mu0_xbar = np.ndarray,
+        eye = np.ndarray,
+        wi_inv = np.ndarray,
         WI_post = np.ndarray,
         alpha = np.ndarray,
         mu_temp = np.ndarray,
-        lam = np.ndarray,
+        chol = np.ndarray,
+        z = np.ndarray,
         mu = np.ndarray)
     cpdef tuple sample_hyperparam(self, np.ndarray feats, bint do_users)
 
     @cython.locals(
+        indices = np.ndarray,
+        norm_ratings = np.ndarray,
+        bounds = np.ndarray,
+        num = cython.int,
+        d = cython.int,
+        a = cython.int,
         rated_feats = np.ndarray,
-        cov = np.ndarray,
-        mean = np.ndarray,
-        lam = np.ndarray)
-    cpdef np.ndarray sample_feature(self, int n, bint is_user,
-            np.ndarray mu, np.ndarray alpha, np.ndarray oth_feats,
-            np.ndarray rated_indices, np.ndarray ratings)
+        x = np.ndarray,
+        var = np.ndarray,
+        gram = np.ndarray,
+        prec = np.ndarray,
+        rhs = np.ndarray,
+        chol = np.ndarray,
+        z = np.ndarray)
+    cpdef np.ndarray sample_features(self, np.ndarray mu, np.ndarray alpha,
+            np.ndarray oth_feats, tuple group)
 
     # samples() described in the .py file, because I can't get it to work here
 
@@ -55,7 +70,6 @@ cdef class BayesianPMF(ProbabilisticMatrixFactorization):
     # seems to break everything
     #cpdef np.ndarray predict(self, object samples_iter, object which=*)
 
-    @cython.locals(vals=cython.list)
     cpdef np.ndarray pred_variance(self, object samples_iter, object which=*)
 
     #cpdef np.ndarray total_variance(self, object samples_iter, object which=*)
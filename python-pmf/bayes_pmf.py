@@ -11,8 +11,8 @@ NOTE: this should be considered depracated;
 
 from __future__ import print_function # silly cython
 
-from collections import defaultdict, namedtuple
-from copy import deepcopy
+from collections import namedtuple
+from copy import copy, deepcopy
 from itertools import islice, repeat
 import multiprocessing
 import random
@@ -20,7 +20,9 @@ from threading import Thread
 import warnings
 
 import numpy as np
-from scipy import stats, integrate
+from scipy import stats, integrate, sparse
+from scipy.linalg import blas
+from scipy.linalg import cholesky, cho_factor, cho_solve, solve_triangular
 
 # TODO: make this actually work....
 #if not cython.compiled:
@@ -50,22 +52,120 @@ def sample_wishart(sigma, dof):
     # schemes
     if dof <= 81+n and dof == round(dof):
         # direct
-        X = np.dot(chol, np.random.normal(size=(n,dof)))
+        X = np.dot(chol, np.random.normal(size=(n,int(dof))))
     else:
+        # bartlett: A is lower triangular, so chol A is a triangular product
         A = np.diag(np.sqrt(np.random.chisquare(dof - np.arange(0,n),size=n)))
-        A[np.tri(n,k=-1,dtype=bool)] = np.random.normal(size=(n*(n-1)/2.))
-        X = np.dot(chol,A)
+        A[np.tri(n,k=-1,dtype=bool)] = np.random.normal(size=n*(n-1)//2)
+        X = blas.dtrmm(1.0, chol, A, lower=1)
 
-    return np.dot(X, X.T)
+    # X X^T is symmetric; syrk only computes the upper triangle of it
+    Y = blas.dsyrk(1.0, X)
+    return np.triu(Y) + np.triu(Y, 1).T
 
 
-def iter_mean(iterable):
-    i = iter(iterable)
-    total = next(i)
-    count = -1
-    for count, x in enumerate(i):
-        total += x
-    return total / (count + 2)
+def _make_group(indices, norm_ratings, bounds):
+    '''
+    Builds a grouping of ratings as used by BayesianPMF.sample_features: the
+    entries for id k are in positions bounds[k]:bounds[k+1] of indices and
+    norm_ratings, and summer is a sparse matrix that sums each id's block.
+    '''
+    num = bounds.shape[0] - 1
+    nnz = indices.shape[0]
+    summer = sparse.csr_matrix((np.ones(nnz), np.arange(nnz), bounds),
+                               shape=(num, nnz))
+    return indices, norm_ratings, bounds, summer
+
+
+def _spd_inverse(a):
+    '''
+    Inverts a symmetric positive definite matrix via its cholesky factor.
+    '''
+    return cho_solve(cho_factor(a, check_finite=False),
+                     np.eye(a.shape[0]), check_finite=False)
+
+
+def _batch_solve_lower(L, b, trans=False):
+    '''
+    Solves L x = b, or L^T x = b if trans, for a stack of lower-triangular
+    matrices L (num, d, d) and right-hand sides b (num, d), by substitution
+    over the d rows (vectorized over the stack).
+    '''
+    d = b.shape[1]
+    x = np.empty_like(b)
+    if not trans:
+        for i in range(d):
+            x[:, i] = (b[:, i] - np.einsum('nj,nj->n', L[:, i, :i], x[:, :i])
+                      ) / L[:, i, i]
+    else:
+        for i in reversed(range(d)):
+            x[:, i] = (b[:, i] - np.einsum('nj,nj->n', L[:, i+1:, i],
+                                           x[:, i+1:])
+                      ) / L[:, i, i]
+    return x
+
+
+def _group_chunks(group, num_chunks):
+    '''
+    Splits one of the groupings from BayesianPMF._ratings_by_index into
+    (at most) num_chunks groupings, each over a consecutive range of ids.
+    '''
+    indices, norm_ratings, bounds, summer = group
+    num = bounds.shape[0] - 1
+    edges = np.linspace(0, num, min(num_chunks, num) + 1).astype(int)
+    for start, stop in zip(edges[:-1], edges[1:]):
+        lo, hi = bounds[start], bounds[stop]
+        yield _make_group(indices[lo:hi], norm_ratings[lo:hi],
+                          bounds[start:stop+1] - lo)
+
+
+# how many predicted entries to compute at once for a SampleStack
+PRED_CHUNK_ELEMENTS = 2 ** 25
+
+class SampleStack(object):
+    '''
+    A series of MCMC samples of user and item features, stored as contiguous
+    (num_samps, num_users, latent_d) and (num_samps, num_items, latent_d)
+    arrays. Iterates over (u, v) pairs just like a list of samples, but
+    BayesianPMF's predict and friends do batched products over the stack.
+    '''
+    def __init__(self, users, items):
+        if users.shape[0] != items.shape[0]:
+            raise ValueError("need the same number of user and item samples")
+        self.users = users
+        self.items = items
+
+    @classmethod
+    def from_samples(cls, samples_iter, num, dtype=np.float32):
+        '''
+        Copies the first num (u, v) samples from samples_iter (e.g. a
+        BayesianPMF.samples() chain) into a new SampleStack, filling
+        preallocated arrays as they come in.
+        '''
+        users = items = None
+        count = 0
+        for u, v in islice(samples_iter, num):
+            if users is None:
+                users = np.empty((num,) + u.shape, dtype=dtype)
+                items = np.empty((num,) + v.shape, dtype=dtype)
+            users[count] = u
+            items[count] = v
+            count += 1
+
+        if users is None:
+            raise ValueError("need at least one sample")
+        return cls(users[:count], items[:count])
+
+    def __len__(self):
+        return self.users.shape[0]
+
+    def __iter__(self):
+        return zip(self.users, self.items)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return SampleStack(self.users[idx], self.items[idx])
+        return self.users[idx], self.items[idx]
 
 ################################################################################
 
@@ -133,6 +233,34 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
             state['__dict__'] = self.__dict__
         return state
 
+    def snapshot(self):
+        '''
+        Returns copies of the parts of the model that fitting and adding
+        ratings change, so that restore() can put them back. Much cheaper
+        than a deepcopy of the whole thing.
+        '''
+        return dict(
+            users=self.users.copy(),
+            items=self.items.copy(),
+            ratings=self.ratings.copy(),
+            mean_rating=self.mean_rating,
+            rated=self.rated.copy(),
+            unrated=self.unrated.copy(),
+            sigma_sq=self.sigma_sq,
+            sigma_u_sq=self.sigma_u_sq,
+            sigma_v_sq=self.sigma_v_sq,
+        )
+
+    def restore(self, snap):
+        '''
+        Puts back state saved by snapshot(). The snapshot isn't shared with
+        the model afterwards, so it can be restored more than once.
+        '''
+        state = dict(snap)
+        for k in ('users', 'items', 'ratings', 'rated', 'unrated'):
+            state[k] = state[k].copy()
+        self.__setstate__(state)
+
 
     def _set_rating_values(self, vals):
         if vals:
@@ -153,6 +281,21 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
             _set_rating_values)
     rating_bounds = property(lambda self: self._rating_bounds)
 
+    # the hyperparams are (wi, b0, df, mu0); keep the inverse of the
+    # wishart scale wi alongside, since it's needed on every draw
+    def _set_u_hyperparams(self, hyperparams):
+        self._u_hyperparams = hyperparams
+        self._u_wi_inv = _spd_inverse(hyperparams[0])
+
+    def _set_v_hyperparams(self, hyperparams):
+        self._v_hyperparams = hyperparams
+        self._v_wi_inv = _spd_inverse(hyperparams[0])
+
+    u_hyperparams = property(lambda self: self._u_hyperparams,
+            _set_u_hyperparams)
+    v_hyperparams = property(lambda self: self._v_hyperparams,
+            _set_v_hyperparams)
+
 
     def sample_hyperparam(self, feats, do_users):
         '''
@@ -163,6 +306,7 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
         '''
 
         wi, b0, df, mu0 = self.u_hyperparams if do_users else self.v_hyperparams
+        wi_inv = self._u_wi_inv if do_users else self._v_wi_inv
 
         N = feats.shape[0]
         x_bar = np.mean(feats, axis=0).T
@@ -170,59 +314,128 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
 
         mu0_xbar = mu0 - x_bar
 
-        WI_post = np.linalg.inv(
-                np.linalg.inv(wi)
-                + N * S_bar
-                + (b0 * N) / (b0 + N) * np.dot(mu0_xbar, mu0_xbar.T))
+        if self.latent_d == 1:
+            # everything's a scalar, and a 1-d wishart is a scaled chi^2
+            WI_post = 1 / (wi_inv + N * S_bar
+                           + (b0 * N) / (b0 + N) * mu0_xbar ** 2)
+            alpha = WI_post * np.random.chisquare(df + N)
+
+            mu_temp = (b0 * mu0 + N * x_bar) / (b0 + N)
+            mu = mu_temp + (np.random.normal(0, 1, 1)
+                            / np.sqrt((b0 + N) * alpha[0]))
+            return mu, alpha
+
+        # this is symmetric positive definite, so invert it through its
+        # cholesky factor rather than with a general inverse
+        eye = np.eye(self.latent_d)
+        WI_post = cho_solve(
+                cho_factor(wi_inv
+                           + N * S_bar
+                           + (b0 * N) / (b0 + N) * np.dot(mu0_xbar, mu0_xbar.T),
+                           check_finite=False),
+                eye, check_finite=False)
         WI_post /= 2
         WI_post = WI_post + WI_post.T
 
         alpha = sample_wishart(WI_post, df + N)
 
+        # mu ~ N(mu_temp, ((b0 + N) alpha)^-1); as in sample_features, sample
+        # from the cholesky factor of the precision instead of inverting it
         mu_temp = (b0 * mu0 + N * x_bar) / (b0 + N)
-        lam = np.linalg.cholesky(np.linalg.inv((b0 + N) * alpha))
-        mu = np.dot(lam, np.random.normal(0, 1, self.latent_d)) + mu_temp
+        chol = cholesky((b0 + N) * alpha, lower=True, check_finite=False)
+        z = np.random.normal(0, 1, self.latent_d)
+        mu = mu_temp + solve_triangular(chol, z, trans='T', lower=True,
+                                        check_finite=False)
 
         return mu, alpha
 
 
-    def sample_feature(self, n, is_user, mu, alpha, oth_feats,
-                       rated_indices, ratings):
+    def sample_features(self, mu, alpha, oth_feats, group):
         '''
-        Samples a user/item feature vector, conditional on the entire
-        matrix of other item/user features.
+        Samples all of the user/item feature vectors at once, conditional on
+        the entire matrix of other item/user features. Each id's conditional
+        is independent of the others', so this does the linear algebra as a
+        single batch of latent_d x latent_d problems.
 
-        n: the id of the user/item
-        is_user: true if this is a user, false if an item
-        mu: the mean hyperparameter for users if is_user, items if not
+        mu: the mean hyperparameter for users if sampling users, items if not
         alpha: the precision hyperparamater
         oth_feats: self.items/self.users
-        rated_indices: indices of the items rated by this user / users
-                       who rated this item
-        ratings: ratings by this user / for this item for rated_indices
+        group: users_by_item / items_by_user from _ratings_by_index, with
+               the indices of the other items/users rated and the ratings
+               (with self.mean_rating already subtracted if
+               self.subtract_mean) for each id
         '''
+        indices, norm_ratings, bounds, summer = group
+        num = bounds.shape[0] - 1
+        d = self.latent_d
+
+        # the per-id sums of R^T R and R^T y, as sparse matrix products
+        rated_feats = oth_feats[indices, :]
+
+        if d == 1:
+            # scalar version of the below, without any linear algebra calls
+            x = rated_feats[:, 0]
+            var = 1 / (alpha.item() + self.beta * summer.dot(x * x))
+            mean = var * (self.beta * summer.dot(x * norm_ratings)
+                          + alpha.item() * mu.item())
+            z = np.random.normal(0, 1, num)
+            return (mean + np.sqrt(var) * z)[:, np.newaxis]
+
+        gram = np.empty((num, d, d))
+        for a in range(d):
+            # it's symmetric, so only compute the upper triangle
+            gram[:, a, a:] = summer.dot(
+                    rated_feats[:, a, np.newaxis] * rated_feats[:, a:])
+            gram[:, a+1:, a] = gram[:, a, a+1:]
+
+        prec = alpha + self.beta * gram
+        rhs = (self.beta * summer.dot(rated_feats * norm_ratings[:, np.newaxis])
+               + np.dot(alpha, mu))
+
+        # work with the cholesky factor of the posterior precision directly,
+        # rather than inverting it and then factoring the covariance:
+        # if prec = L L^T, then mean + L^-T z has covariance prec^-1, and
+        # mean = L^-T L^-1 rhs, so the two L^-T solves combine into one
+        chol = np.linalg.cholesky(prec)
+        z = np.random.normal(0, 1, (num, d))
+        return _batch_solve_lower(
+                chol, _batch_solve_lower(chol, rhs) + z, trans=True)
+
+    def _ratings_by_index(self):
+        '''
+        Groups the known ratings by item and by user, returning
+        users_by_item, items_by_user, each as described in _make_group.
+        These only depend on the ratings, so are built once per chain.
 
-        rated_feats = oth_feats[rated_indices, :]
-        if self.subtract_mean:
-            ratings = ratings - self.mean_rating
-
-        cov = np.linalg.inv(alpha +
-                self.beta * np.dot(rated_feats.T, rated_feats))
-        mean = np.dot(cov,
-                self.beta * np.dot(rated_feats.T, ratings)
-                + np.dot(alpha, mu))
-
-        lam = np.linalg.cholesky(cov)
-        return np.dot(lam, np.random.normal(0, 1, self.latent_d)) + mean
+        The ratings have self.mean_rating subtracted already if
+        self.subtract_mean, since they don't change between Gibbs sweeps.
+        '''
+        offset = self.mean_rating if self.subtract_mean else 0
+
+        # split the (user, item, rating) rows into separate columns, with
+        # integer ids, so sorting and indexing don't go through floats
+        ids = (self.ratings[:, 0].astype(np.int32),
+               self.ratings[:, 1].astype(np.int32))
+        norm_ratings = self.ratings[:, 2] - offset
+
+        # sort by the key column, so that each key's entries are contiguous
+        groups = []
+        for key_col, idx_col, num in ((1, 0, self.num_items),
+                                      (0, 1, self.num_users)):
+            order = np.argsort(ids[key_col], kind='mergesort')
+            bounds = np.searchsorted(ids[key_col][order], np.arange(num + 1))
+            groups.append(_make_group(
+                    ids[idx_col][order], norm_ratings[order], bounds))
+
+        users_by_item, items_by_user = groups
+        return users_by_item, items_by_user
 
     @cython.locals(
         num_gibbs=cython.int,
-        users_by_item=dict, items_by_user=dict,
+        users_by_item=tuple, items_by_user=tuple,
         user_sample=np.ndarray, item_sample=np.ndarray,
         mu_u=np.ndarray, mu_v=np.ndarray,
         alpha_u=np.ndarray, alpha_v=np.ndarray,
-        rated_indices=np.ndarray, ratings=np.ndarray,
-        user_id=cython.int, item_id=cython.int,
     )
     def samples(self, num_gibbs=2, fit_first=False):
         '''
@@ -238,21 +451,7 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
         If fit_first is True, calls self.do_fit() to fit the MAP estimate.
         '''
         # find rated indices now, to avoid repeated lookups
-        users_by_i = defaultdict(lambda: ([], []))
-        items_by_u = defaultdict(lambda: ([], []))
-
-        for user, item, rating in self.ratings:
-            users_by_i[item][0].append(user)
-            users_by_i[item][1].append(rating)
-
-            items_by_u[user][0].append(item)
-            items_by_u[user][1].append(rating)
-
-        users_by_item = {k: (np.asarray(i, dtype=int), np.asarray(r))
-                         for k, (i,r) in users_by_i.items()}
-        items_by_user = {k: (np.asarray(i, dtype=int), np.asarray(r))
-                         for k, (i,r) in items_by_u.items()}
-        del users_by_i, items_by_u
+        users_by_item, items_by_user = self._ratings_by_index()
 
         # fit the MAP estimate, if asked to
         if fit_first:
@@ -281,30 +480,17 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
 
             # Gibbs updates for user, item feature vectors
             for gibbs in range(num_gibbs):
-
-                user_sample = np.empty_like(user_sample)
-                for user_id in range(self.num_users):
-                    rated_indices, ratings = items_by_user[user_id]
-
-                    user_sample[user_id] = self.sample_feature(
-                            user_id, True, mu_u, alpha_u, item_sample,
-                            rated_indices, ratings
-                    )
-
-                item_sample = np.empty_like(item_sample)
-                for item_id in range(self.num_items):
-                    rated_indices, ratings = users_by_item[item_id]
-
-                    item_sample[item_id] = self.sample_feature(
-                            item_id, False, mu_v, alpha_v, user_sample,
-                            rated_indices, ratings)
+                user_sample = self.sample_features(
+                        mu_u, alpha_u, item_sample, items_by_user)
+                item_sample = self.sample_features(
+                        mu_v, alpha_v, user_sample, users_by_item)
 
             yield user_sample, item_sample
 
 
 
     def samples_parallel(self, num_gibbs=2, pool=None, multiproc_mode=None,
-                fit_first=False):
+                fit_first=False, num_chunks=None):
         '''
         Runs the Markov chain starting from the current MAP approximation in
         self.users, self.items. Yields sampled user, item features forever.
@@ -330,6 +516,10 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
 
         If fit_first is True, first calls .do_fit() to fit the MAP estimate.
         If multiproc_mode is 'force', offloads this fitting to the pool.
+
+        Users / items are sent to the pool in num_chunks blocks each; each
+        block carries a copy of the model, so by default this is 4 per pool
+        process.
         '''
 
         if multiproc_mode == 'force' and pool is None:
@@ -339,20 +529,7 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
         force_multiproc = multiproc_mode == 'force'
 
         # find rated indices now, to avoid repeated lookups
-        users_by_item = defaultdict(lambda: ([], []))
-        items_by_user = defaultdict(lambda: ([], []))
-
-        for user, item, rating in self.ratings:
-            users_by_item[item][0].append(user)
-            users_by_item[item][1].append(rating)
-
-            items_by_user[user][0].append(item)
-            items_by_user[user][1].append(rating)
-
-        users_by_item = {k: (np.asarray(i, dtype=int), np.asarray(r))
-                         for k, (i,r) in users_by_item.items()}
-        items_by_user = {k: (np.asarray(i, dtype=int), np.asarray(r))
-                         for k, (i,r) in items_by_user.items()}
+        users_by_item, items_by_user = self._ratings_by_index()
 
         # fit the MAP estimate, if asked to
         if fit_first:
@@ -381,9 +558,17 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
 
         # TODO: could try using pool.imap if memory becomes an issue
         # could also use map_async
-        # or manually distribute chunks of rows to speed up computation
         mapper = pool.map if pool is not None else map
 
+        # hand the pool blocks of users / items to sample in a batch, rather
+        # than sending everything over once per row
+        if pool is None:
+            num_chunks = 1
+        elif num_chunks is None:
+            num_chunks = 4 * pool._processes
+        user_chunks = list(_group_chunks(items_by_user, num_chunks))
+        item_chunks = list(_group_chunks(users_by_item, num_chunks))
+
         while True:
             # sample from hyperparameters
             if force_multiproc:
@@ -402,24 +587,15 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
             for gibbs in range(num_gibbs):
                 #print('\t\t Gibbs sampling {}'.format(gibbs))
 
-                res = mapper(_feat_sampler,
-                        ((self, user_id, True, mu_u, alpha_u, item_sample)
-                            + items_by_user[user_id]
-                         for user_id in range(self.num_users)))
-
-                user_sample = np.zeros_like(user_sample)
-                for n, row in enumerate(res):
-                    user_sample[n, :] = row
-
-
-                res = mapper(_feat_sampler,
-                        ((self, item_id, False, mu_v, alpha_v, user_sample)
-                            + users_by_item[item_id]
-                         for item_id in range(self.num_items)))
+                res = mapper(_feats_sampler,
+                        ((self, mu_u, alpha_u, item_sample, chunk)
+                         for chunk in user_chunks))
+                user_sample = np.vstack(list(res))
 
-                item_sample = np.zeros_like(item_sample)
-                for n, row in enumerate(res):
-                    item_sample[n, :] = row
+                res = mapper(_feats_sampler,
+                        ((self, mu_v, alpha_v, user_sample, chunk)
+                         for chunk in item_chunks))
+                item_sample = np.vstack(list(res))
 
             yield user_sample, item_sample
 
@@ -430,22 +606,97 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
         res[which] = vals
         return res
 
+    def predicted_matrix32(self, u, v, out=None):
+        '''
+        Like predicted_matrix(u, v), but in single precision. The spread
+        across samples is far bigger than float32 error, and the smaller
+        matrices make the per-sample products and accumulations cheaper.
+
+        u and v can also be stacks of samples, (num_samps, num_users, d) and
+        (num_samps, num_items, d), giving a stack of predicted matrices.
+        '''
+        pred = np.matmul(u.astype(np.float32, copy=False),
+                         np.swapaxes(v.astype(np.float32, copy=False), -1, -2),
+                         out=out)
+        if self.subtract_mean:
+            pred += np.float32(self.mean_rating)
+        return pred
+
+    def _prediction_chunks(self, samples_iter, which=Ellipsis):
+        '''
+        Yields the predicted matrices (restricted to which) for a series of
+        samples, as float32 arrays stacked along a new first axis.
+
+        For a SampleStack, does a chunk of samples at a time with one batched
+        matmul. Otherwise, does one sample at a time into a reused buffer, so
+        each chunk is only valid until the next one is yielded.
+        '''
+        if which is None:
+            which = Ellipsis
+        idx = (slice(None),) + (which if isinstance(which, tuple) else (which,))
+
+        if isinstance(samples_iter, SampleStack):
+            step = max(1, PRED_CHUNK_ELEMENTS
+                          // (self.num_users * self.num_items))
+            for start in range(0, len(samples_iter), step):
+                yield self.predicted_matrix32(
+                    samples_iter.users[start:start+step],
+                    samples_iter.items[start:start+step])[idx]
+        else:
+            buf = np.empty((1, self.num_users, self.num_items),
+                           dtype=np.float32)
+            for u, v in samples_iter:
+                self.predicted_matrix32(u, v, out=buf[0])
+                yield buf[idx]
+
     def predict(self, samples_iter, which=Ellipsis):
         '''
         Gives the mean reconstruction given a series of samples.
         '''
-        return iter_mean(self.predicted_matrix(u, v)[which]
-                         for u, v in samples_iter)
+        total = None
+        n = 0
+        for preds in self._prediction_chunks(samples_iter, which):
+            if total is None:
+                total = preds.sum(0)
+            else:
+                total += preds.sum(0)
+            n += preds.shape[0]
+
+        if total is None:
+            raise ValueError("need at least one sample")
+        return total / n
 
     def pred_variance(self, samples_iter, which=Ellipsis):
         '''
         Gives the variance of each prediction in a series of samples.
         '''
-        if which is None:
-            which = Ellipsis
+        return self.predict_and_var(samples_iter, which)[1]
 
-        vals = [self.predicted_matrix(u, v)[which] for u, v in samples_iter]
-        return np.var(vals, 0)
+    def predict_and_var(self, samples_iter, which=Ellipsis):
+        '''
+        Gives the mean reconstruction and the variance of each prediction
+        in a series of samples, in a single pass (Welford's algorithm, merging
+        in a chunk of samples at a time), so that the samples' predictions
+        don't all need to be kept around.
+        '''
+        mean = M2 = None
+        n = 0
+        for preds in self._prediction_chunks(samples_iter, which):
+            k = preds.shape[0]
+            chunk_mean = preds.mean(0)
+            chunk_M2 = ((preds - chunk_mean) ** 2).sum(0)
+            if mean is None:
+                mean = chunk_mean
+                M2 = chunk_M2
+            else:
+                delta = chunk_mean - mean
+                mean += delta * (k / (n + k))
+                M2 += chunk_M2 + delta ** 2 * (n * k / (n + k))
+            n += k
+
+        if mean is None:
+            raise ValueError("need at least one sample")
+        return mean, M2 / n
 
     def total_variance(self, samples_iter, which=Ellipsis):
         '''
@@ -530,12 +781,15 @@ class BayesianPMF(ProbabilisticMatrixFactorization):
         Gives the portion of the time each matrix element was >= cutoff
         in a series of samples.
         '''
-        counts = np.zeros((self.num_users, self.num_items), dtype=int)[which]
+        # uint32 is plenty for a count of samples, and a quarter the size
+        counts = np.zeros((self.num_users, self.num_items),
+                          dtype=np.uint32)[which]
+
         num = 0
-        for u, v in samples_iter:
-            counts += (self.predicted_matrix(u, v)[which] >= cutoff)
-            num += 1
-        return counts / float(num)
+        for preds in self._prediction_chunks(samples_iter, which):
+            counts += (preds >= cutoff).sum(0, dtype=np.uint32)
+            num += preds.shape[0]
+        return counts.astype(np.float32) / num
 
     def random(self, samples_iter, which=Ellipsis):
         shape = np.empty((self.num_users, self.num_items))[which].shape
@@ -553,9 +807,9 @@ def _fit_pmf(pmf):
 def _hyperparam_sampler(bpmf, *args):
     return bpmf.sample_hyperparam(*args)
 
-def _feat_sampler(args):
+def _feats_sampler(args):
     bpmf, *args = args
-    return bpmf.sample_feature(*args)
+    return bpmf.sample_features(*args)
 
 def _integrate_lookahead(fn, bpmf, i, j, discrete, params, fit_first, num_samps):
     if (i, j) in bpmf.rated:
@@ -629,10 +883,10 @@ def test_vs_map():
         predicted_map = bpmf.predicted_matrix()
 
         print("doing MCMC...")
-        samps = list(islice(bpmf.samples(), 500))
+        samps = SampleStack.from_samples(bpmf.samples(), 500)
 
-        bayes_rmses_1.append(bpmf.bayes_rmse(islice(samps, 250), true_r))
-        bayes_rmses_2.append(bpmf.bayes_rmse(islice(samps, 250, None), true_r))
+        bayes_rmses_1.append(bpmf.bayes_rmse(samps[:250], true_r))
+        bayes_rmses_2.append(bpmf.bayes_rmse(samps[250:], true_r))
         bayes_rmses_combo.append(bpmf.bayes_rmse(samps, true_r))
 
         map_rmses.append(bpmf.rmse(true_r))
@@ -671,7 +925,7 @@ KEYS = {
 
 def fetch_samples(bpmf, num, *args, **kwargs):
     try:
-        samps = list(islice(bpmf.samples(*args, **kwargs), num))
+        samps = SampleStack.from_samples(bpmf.samples(*args, **kwargs), num)
         pred = bpmf.predict(samps)
     except Exception:
         import traceback
@@ -785,7 +1039,9 @@ def compare_active(key_names, latent_d, real, ratings, rating_vals=None,
     pool = multiprocessing.Pool(procs) if procs is None or procs >= 1 else None
 
     print("Getting initial MCMC samples...")
-    samples = list(islice(bpmf_init.samples(fit_first=fit_type), num_samps))
+    samples = SampleStack.from_samples(
+            bpmf_init.samples(fit_first=fit_type), num_samps)
+    init_snap = bpmf_init.snapshot()
 
     init_rmse = bpmf_init.bayes_rmse(samples, real, test_on)
     print("Initial RMSE: {}".format(init_rmse))
@@ -800,8 +1056,11 @@ def compare_active(key_names, latent_d, real, ratings, rating_vals=None,
 
     # continue with each key for the fit
     def eval_key(key_name):
+        bpmf = copy(bpmf_init)
+        bpmf.restore(init_snap)
+
         res = full_test(
-                deepcopy(bpmf_init), samples, real, key_name,
+                bpmf, samples, real, key_name,
                 pool=pool, multieval=threaded,
                 num_samps=num_samps,
                 init_rmse=init_rmse, test_on=test_on,
@@ -0,0 +1,163 @@
+import numpy as np
+
+import bayes_pmf
+from bayes_pmf import BayesianPMF, SampleStack, sample_wishart
+
+NUM_SAMPS = 4000
+
+def _make_bpmf(latent_d):
+    # 4 users x 5 items; user 1 and item 2 have no ratings at all
+    ratings = np.array([(i, j, np.random.randint(1, 6))
+                        for i in range(4) for j in range(5)
+                        if i != 1 and j != 2 and (i + j) % 3],
+                       dtype=float)
+    bpmf = BayesianPMF(ratings, latent_d, subtract_mean=True)
+    assert (bpmf.num_users, bpmf.num_items) == (4, 5)
+    return bpmf
+
+def _random_prec(dim):
+    a = np.random.normal(0, 1, (dim, dim))
+    return np.dot(a, a.T) + dim * np.eye(dim)
+
+
+def check_moments(samps, mean, cov):
+    '''
+    Checks that the rows of samps have about the given mean and covariance,
+    to within 5 standard errors (the samples should be normal).
+    '''
+    n = samps.shape[0]
+    std = np.sqrt(np.diag(cov))
+
+    samp_mean = samps.mean(0)
+    assert np.all(np.abs(samp_mean - mean) < 5 * std / np.sqrt(n)), \
+        "%r - %r" % (samp_mean, mean)
+
+    samp_cov = np.cov(samps, rowvar=0).reshape(cov.shape)
+    tol = 5 * np.sqrt((np.outer(std, std) ** 2 + cov ** 2) / n)
+    assert np.all(np.abs(samp_cov - cov) < tol), "%r - %r" % (samp_cov, cov)
+
+def feature_moments(bpmf, mu, alpha, oth_feats, key_col, k):
+    '''
+    The mean and covariance of the conditional distribution of user k's
+    features (if key_col is 0) or item k's (if key_col is 1), worked out
+    directly from bpmf.ratings: prec^-1 rhs and prec^-1.
+    '''
+    rows = bpmf.ratings[bpmf.ratings[:, key_col] == k]
+    rated_feats = oth_feats[rows[:, 1 - key_col].astype(int), :]
+    norm_ratings = rows[:, 2] - bpmf.mean_rating
+
+    prec = alpha + bpmf.beta * np.dot(rated_feats.T, rated_feats)
+    rhs = bpmf.beta * np.dot(rated_feats.T, norm_ratings) + np.dot(alpha, mu)
+    cov = np.linalg.inv(prec)
+    return np.dot(cov, rhs), cov
+
+def check_sample_features(latent_d, num_samps=NUM_SAMPS):
+    bpmf = _make_bpmf(latent_d)
+    users_by_item, items_by_user = bpmf._ratings_by_index()
+
+    mu = np.random.normal(0, 1, latent_d)
+    alpha = _random_prec(latent_d)
+
+    for key_col, oth_feats, group, num in (
+            (0, bpmf.items, items_by_user, bpmf.num_users),
+            (1, bpmf.users, users_by_item, bpmf.num_items)):
+        samps = np.array([
+            bpmf.sample_features(mu, alpha, oth_feats, group)
+            for x in range(num_samps)])
+        assert samps.shape == (num_samps, num, latent_d)
+
+        for k in range(num):
+            mean, cov = feature_moments(bpmf, mu, alpha, oth_feats, key_col, k)
+            check_moments(samps[:, k, :], mean, cov)
+
+def test_sample_features():
+    check_sample_features(3)
+
+def test_sample_features_1d():
+    check_sample_features(1)
+
+def test_sample_hyperparam_1d(num_samps=NUM_SAMPS):
+    bpmf = _make_bpmf(1)
+    feats = np.random.normal(1, 2, (20, 1))
+    wi, b0, df, mu0 = bpmf.u_hyperparams
+
+    # alpha ~ W_post chi^2(df + N), mu | alpha ~ N(mu_post, ((b0 + N) alpha)^-1)
+    N = feats.shape[0]
+    x_bar = feats.mean()
+    W_post = 1 / (1 / wi[0, 0] + N * feats.var(ddof=1)
+                  + (b0 * N) / (b0 + N) * (mu0[0] - x_bar) ** 2)
+    mu_post = (b0 * mu0[0] + N * x_bar) / (b0 + N)
+    k = df + N
+
+    mus = np.empty(num_samps)
+    alphas = np.empty(num_samps)
+    for x in range(num_samps):
+        mu, alpha = bpmf.sample_hyperparam(feats, True)
+        assert mu.shape == (1,)
+        assert alpha.shape == (1, 1)
+        mus[x] = mu[0]
+        alphas[x] = alpha[0, 0]
+
+    alpha_std = W_post * np.sqrt(2 * k)
+    assert abs(alphas.mean() - W_post * k) < 5 * alpha_std / np.sqrt(num_samps)
+
+    # E[1 / chi^2(k)] = 1 / (k - 2)
+    mu_std = np.sqrt(1 / ((b0 + N) * W_post * (k - 2)))
+    assert abs(mus.mean() - mu_post) < 5 * mu_std / np.sqrt(num_samps)
+
+
+def check_predictions(bpmf, samps, make_samples, which):
+    preds = np.array([bpmf.predicted_matrix(u, v)[which] for u, v in samps])
+    cutoff = bpmf.mean_rating # about half of the predictions are above this
+
+    # predictions are done in float32
+    assert np.allclose(bpmf.predict(make_samples(), which),
+                       preds.mean(0), rtol=1e-4, atol=1e-4)
+    assert np.allclose(bpmf.pred_variance(make_samples(), which),
+                       preds.var(0), rtol=1e-4, atol=1e-4)
+    assert np.allclose(bpmf.prob_ge_cutoff(make_samples(), cutoff, which),
+                       (preds >= cutoff).mean(0))
+
+def test_predictions(num_samps=50):
+    bpmf = _make_bpmf(3)
+    samps = [(np.random.normal(0, 1, bpmf.users.shape),
+              np.random.normal(0, 1, bpmf.items.shape))
+             for x in range(num_samps)]
+    stack = SampleStack(np.array([u for u, v in samps]),
+                        np.array([v for u, v in samps]))
+
+    mask = np.zeros((bpmf.num_users, bpmf.num_items), dtype=bool)
+    mask[0, 1] = mask[2, :] = mask[3, 4] = True
+    whiches = [Ellipsis, (np.array([0, 2, 3]), np.array([1, 1, 4])), mask]
+
+    old_chunk = bayes_pmf.PRED_CHUNK_ELEMENTS
+    try:
+        # a few samples per chunk, so SampleStacks get merged chunk by chunk
+        bayes_pmf.PRED_CHUNK_ELEMENTS = 7 * bpmf.num_users * bpmf.num_items
+
+        for which in whiches:
+            check_predictions(bpmf, samps, lambda: samps, which)
+            check_predictions(bpmf, samps, lambda: iter(samps), which)
+            check_predictions(bpmf, samps, lambda: stack, which)
+    finally:
+        bayes_pmf.PRED_CHUNK_ELEMENTS = old_chunk
+
+
+def check_wishart_mean(dof, dim=3, num_samps=NUM_SAMPS):
+    sigma = np.linalg.inv(_random_prec(dim))
+    samps = np.array([sample_wishart(sigma, dof) for x in range(num_samps)])
+    assert np.all(samps == samps.swapaxes(1, 2))
+
+    # E[W] = dof sigma, var(W_ij) = dof (sigma_ij^2 + sigma_ii sigma_jj)
+    diag = np.diag(sigma)
+    std = np.sqrt(dof * (sigma ** 2 + np.outer(diag, diag)))
+    samp_mean = samps.mean(0)
+    tol = 5 * std / np.sqrt(num_samps)
+    assert np.all(np.abs(samp_mean - dof * sigma) < tol), \
+        "%r - %r" % (samp_mean, dof * sigma)
+
+def test_wishart_direct():
+    check_wishart_mean(5) # integer dof <= 81 + dim: sums of outer products
+
+def test_wishart_bartlett():
+    check_wishart_mean(100) # past the cutoff, so uses the Bartlett factor